@@ -35,11 +35,27 @@ Nota bene
 ---------
 
 This makes use of several temporary files. Temporary files are created using
-`tempfile.mkstemp`. If you wish to generate these files in a different
+`tempfile.mkdtemp`. If you wish to generate these files in a different
 directory than the OS default, set the $TMPDIR, $TEMP, or $TMP environmental
-variables.
-
-All temporary files are removed when the PairNGramAligner object is deleted.
+variables. The small files (the covering grammar and the channel models
+produced by each random start) can instead be placed in a separate directory,
+such as a RAM-backed tmpfs like /dev/shm, using `--small_tempdir`.
+
+Temporary files are removed as soon as they are no longer needed: the channel
+model for each random start is deleted as soon as it is beaten by another
+start, and the lexicon and alignment FARs are deleted once they have been
+consumed.
+
+The total size of the temporary files on disk (i.e., excluding those in
+`--small_tempdir`, if it is set) can be limited with `--disk_budget`. When the
+channel models are on disk, the number of concurrent random starts is reduced
+ahead of time so that they fit within the budget. The lexicon and alignment
+FARs cannot be sized in advance, so for those stages the budget is only
+checked once they are written, and an error is raised if it is exceeded; this
+aborts the run but cannot prevent the disk from filling up. The peak size
+observed is logged at the end. All remaining temporary files are removed when
+the PairNGramAligner object is closed, either explicitly, by exiting a `with`
+block, or when it is deleted.
 
 To see shell commands as they are invoked, set the log level to DEBUG."""
 
@@ -47,13 +63,13 @@ __author__ = "Kyle Gorman"
 
 
 import argparse
+import contextlib
 import functools
 import logging
 import multiprocessing
 import shutil
 import subprocess
 import tempfile
-import operator
 import os
 import random
 import re
@@ -71,6 +87,11 @@ INF = float("inf")
 RAND_MAX = 32767
 
 
+class Error(Exception):
+
+    pass
+
+
 def _str_to_bool(value: str) -> bool:
     """Handler for string-like boolean flag types."""
     value = value.lower()
@@ -99,16 +120,75 @@ class PairNGramAligner:
         pywrapfst.convert, fst_type="compact_string"
     )
 
-    def __init__(self) -> None:
+    def __init__(
+        self, small_tempdir: Optional[str] = None, disk_budget: int = 0
+    ) -> None:
         self.tempdir = tempfile.TemporaryDirectory()
+        # Small files may be placed elsewhere, e.g., on a RAM-backed tmpfs.
+        self.small_tempdir = (
+            tempfile.TemporaryDirectory(dir=small_tempdir)
+            if small_tempdir
+            else self.tempdir
+        )
+        # Budget for the total size of the temporary files on disk, in bytes;
+        # zero means there is no limit.
+        self.disk_budget = disk_budget
+        self.peak_usage = 0
         self.g_path = os.path.join(self.tempdir.name, "g.far")
         self.p_path = os.path.join(self.tempdir.name, "p.far")
-        self.c_path = os.path.join(self.tempdir.name, "c.fst")
-        self.align_path = os.path.join(self.tempdir.name, "align.fst")
+        self.c_path = os.path.join(self.small_tempdir.name, "c.fst")
+        self.align_path = os.path.join(self.small_tempdir.name, "align.fst")
         self.afst_path = os.path.join(self.tempdir.name, "afst.far")
 
+    def __enter__(self) -> "PairNGramAligner":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
     def __del__(self) -> None:
-        self.tempdir.cleanup()
+        self.close()
+
+    def close(self) -> None:
+        """Removes all temporary files."""
+        # Cleanup is a no-op if the directory has already been removed. The
+        # attributes may be missing if the constructor failed.
+        for name in ("small_tempdir", "tempdir"):
+            tempdir = getattr(self, name, None)
+            if tempdir is not None:
+                tempdir.cleanup()
+
+    def _usage(self) -> int:
+        """Computes the total size of the temporary files on disk, in bytes.
+
+        Files in the small temporary directory, if it is distinct, are not
+        counted, since it is meant to be RAM-backed."""
+        return sum(
+            entry.stat().st_size
+            for entry in os.scandir(self.tempdir.name)
+            if entry.is_file()
+        )
+
+    def _check_usage(self, stage: str) -> int:
+        """Records the size of the temporary files and enforces the budget.
+
+        This is a check after the fact: it cannot prevent a stage from
+        exceeding the budget, only stop the run once it has."""
+        usage = self._usage()
+        self.peak_usage = max(self.peak_usage, usage)
+        logging.debug("Scratch usage after %s: %s bytes", stage, f"{usage:,d}")
+        if self.disk_budget and usage > self.disk_budget:
+            raise Error(
+                f"Scratch usage after {stage} ({usage:,d} bytes) exceeds "
+                f"disk budget ({self.disk_budget:,d} bytes)"
+            )
+        return usage
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        """Removes a temporary file, if it exists."""
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
 
     def align(
         self,
@@ -156,6 +236,9 @@ class PairNGramAligner:
         logging.info(
             "Success! FAR path: %s; encoder path: %s", far_path, encoder_path
         )
+        logging.info(
+            "Peak scratch usage on disk: %s bytes", f"{self.peak_usage:,d}"
+        )
 
     @staticmethod
     def _label_union(labels: Set[int], epsilon: bool) -> pynini.Fst:
@@ -221,9 +304,10 @@ class PairNGramAligner:
             f"{PairNGramAligner._narcs(covering):,d}",
         )
         covering.write(self.c_path)
+        self._check_usage("constructing lexicon and covering grammar")
 
     @staticmethod
-    def _random_start(random_start: RandomStart) -> Tuple[str, float]:
+    def _random_start(random_start: RandomStart) -> Tuple[int, str, float]:
         """Performs a single random start."""
         start = time.time()
         # Randomize channel model.
@@ -259,13 +343,15 @@ class PairNGramAligner:
                 match = re.match(r"INFO: Iteration \d+: (-?\d*(\.\d*)?)", line)
                 assert match, line
                 likelihood = float(match.group(1))
+        # The randomized channel model is no longer needed.
+        PairNGramAligner._remove(c_path)
         logging.info(
             "Random start %d; likelihood: %f; time elapsed: %ds",
             random_start.idx,
             likelihood,
             time.time() - start,
         )
-        return (t_path, likelihood)
+        return (random_start.idx, t_path, likelihood)
 
     def _alignments(
         self,
@@ -305,21 +391,64 @@ class PairNGramAligner:
                 self.g_path,
                 self.p_path,
                 self.c_path,
-                self.tempdir.name,
+                self.small_tempdir.name,
                 train_opts,
             )
             for (idx, seed) in enumerate(
                 random.sample(range(1, RAND_MAX), random_starts), 1
             )
         ]
+        # If the channel models are on disk, each concurrent random start needs
+        # room for a randomized and a trained channel model, each about the
+        # size of the covering grammar, and room must be left for the running
+        # best.
+        processes = cores
+        if self.disk_budget and self.small_tempdir is self.tempdir:
+            start_usage = 2 * os.path.getsize(self.c_path)
+            usage = self._check_usage("before random starts")
+            available = self.disk_budget - usage
+            processes = min(
+                cores, (available - start_usage // 2) // start_usage
+            )
+            if processes < 1:
+                raise Error(
+                    f"Disk budget ({self.disk_budget:,d} bytes) is too small "
+                    "to run any random starts"
+                )
+            if processes < cores:
+                logging.info(
+                    "Running %d random starts at a time to fit disk budget",
+                    processes,
+                )
         # Actually run.
         logging.info("Beginning random starts")
-        with multiprocessing.Pool(cores) as pool:
+        best_fst: Optional[str] = None
+        best_likelihood = INF
+        best_idx = 0
+        with multiprocessing.Pool(processes) as pool:
             # Setting chunksize to 1 means that random starts are processed
-            # in roughly the order you'd expect.
-            gen = pool.map(self._random_start, starts, chunksize=1)
-            # Because we're in negative log space.
-            (best_fst, best_likelihood) = min(gen, key=operator.itemgetter(1))
+            # in roughly the order you'd expect. Results are consumed as soon
+            # as they finish, so that losers can be deleted immediately.
+            for (idx, t_path, likelihood) in pool.imap_unordered(
+                self._random_start, starts, chunksize=1
+            ):
+                # Because we're in negative log space. Ties go to the earlier
+                # start, as results may arrive out of order.
+                if best_fst is None or (likelihood, idx) < (
+                    best_likelihood,
+                    best_idx,
+                ):
+                    if best_fst is not None:
+                        self._remove(best_fst)
+                    (best_fst, best_likelihood, best_idx) = (
+                        t_path,
+                        likelihood,
+                        idx,
+                    )
+                else:
+                    self._remove(t_path)
+                self._check_usage("random start")
+        assert best_fst is not None, "No random starts"
         logging.info("Best likelihood: %f", best_likelihood)
         # Moves best likelihood solution to the requested location.
         shutil.move(best_fst, self.align_path)
@@ -337,6 +466,11 @@ class PairNGramAligner:
         cmd.append(self.afst_path)
         logging.debug("Subprocess call: %s", cmd)
         subprocess.check_call(cmd)
+        self._check_usage("computing alignments")
+        # The lexicon FARs and channel model are no longer needed.
+        self._remove(self.g_path)
+        self._remove(self.p_path)
+        self._remove(self.align_path)
 
     def _encode(self, far_path: str, encoder_path: str) -> None:
         """Encodes the alignments."""
@@ -354,10 +488,11 @@ class PairNGramAligner:
             a_writer[key] = self._compactor(fst)
             a_reader.next()
         encoder.write(encoder_path)
+        # The alignment FAR is no longer needed.
+        self._remove(self.afst_path)
 
 
 def main(args: argparse.Namespace) -> None:
-    aligner = PairNGramAligner()
     input_token_type = (
         args.input_token_type
         if args.input_token_type in TOKEN_TYPES
@@ -368,24 +503,25 @@ def main(args: argparse.Namespace) -> None:
         if args.output_token_type in TOKEN_TYPES
         else pynini.SymbolTable.read_text(args.output_token_type)
     )
-    aligner.align(
-        args.tsv_path,
-        args.far_path,
-        args.encoder_path,
-        input_token_type,
-        args.input_epsilon,
-        output_token_type,
-        args.output_epsilon,
-        args.cores,
-        args.random_starts,
-        args.seed,
-        args.batch_size,
-        args.delta,
-        args.lr,
-        args.max_iters,
-        args.fst_default_cache_gc,
-        args.fst_default_cache_gc_limit,
-    )
+    with PairNGramAligner(args.small_tempdir, args.disk_budget) as aligner:
+        aligner.align(
+            args.tsv_path,
+            args.far_path,
+            args.encoder_path,
+            input_token_type,
+            args.input_epsilon,
+            output_token_type,
+            args.output_epsilon,
+            args.cores,
+            args.random_starts,
+            args.seed,
+            args.batch_size,
+            args.delta,
+            args.lr,
+            args.max_iters,
+            args.fst_default_cache_gc,
+            args.fst_default_cache_gc_limit,
+        )
 
 
 if __name__ == "__main__":
@@ -437,6 +573,18 @@ if __name__ == "__main__":
         help="number of random starts (default: %(default)s)",
     )
     parser.add_argument("--seed", type=int, required=True, help="random seed")
+    parser.add_argument(
+        "--small_tempdir",
+        help="directory for small temporary files, e.g., /dev/shm "
+        "(default: the OS default)",
+    )
+    parser.add_argument(
+        "--disk_budget",
+        type=int,
+        default=0,
+        help="maximum total size of temporary files in bytes, or 0 for no "
+        "limit (default: %(default)s)",
+    )
     parser.add_argument("--batch_size", type=int)
     parser.add_argument("--delta", type=float)
     parser.add_argument("--lr", type=float)
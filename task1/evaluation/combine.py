@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Combines hypotheses from multiple systems.
+
+This script assumes each hypothesis file has one example per line, in the same
+order, either as a single column of predictions (as written by `predict.py`)
+or as a two-column input/prediction TSV file. In the latter case only the
+second column is used. Combined predictions are written to stdout, one per
+line.
+
+Two combination methods are supported:
+
+*   `vote`: selects the most frequent prediction (exact match). Ties are
+    broken in favor of the system listed first.
+*   `medoid`: selects the prediction with the least total edit distance to the
+    other systems' predictions. Ties are broken in favor of the more frequent
+    prediction, and then in favor of the system listed first."""
+
+__author__ = "Kyle Gorman"
+
+import argparse
+import contextlib
+import itertools
+import logging
+import multiprocessing
+
+from typing import Iterator, List
+
+import evallib
+
+
+METHODS = {"medoid": evallib.medoid, "vote": evallib.vote}
+
+
+def _lockstep_reader(paths: List[str]) -> Iterator[List[evallib.Labels]]:
+    """Reads aligned hypotheses from multiple filepaths."""
+    with contextlib.ExitStack() as stack:
+        sources = [stack.enter_context(open(path, "r")) for path in paths]
+        for (linenum, lines) in enumerate(
+            itertools.zip_longest(*sources), 1
+        ):
+            if None in lines:
+                raise ValueError(
+                    f"Hypothesis files differ in length at line {linenum}"
+                )
+            # If the line has an input column, we discard it.
+            yield [
+                line.rstrip("\r\n").split("\t")[-1].split() for line in lines
+            ]
+
+
+def main(args: argparse.Namespace) -> None:
+    combiner = METHODS[args.method]
+    # Since the edit distance algorithm is quadratic, let's do this with
+    # multiprocessing. Lines are streamed through the pool in chunks so that
+    # no file has to be held in memory.
+    with multiprocessing.Pool(args.cores) as pool:
+        for hypo in pool.imap(
+            combiner,
+            _lockstep_reader(args.hypo_paths),
+            chunksize=args.chunksize,
+        ):
+            print(" ".join(hypo))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level="INFO", format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Combines hypotheses from multiple systems"
+    )
+    parser.add_argument(
+        "hypo_paths", nargs="+", help="paths to hypothesis files"
+    )
+    parser.add_argument(
+        "--method",
+        choices=sorted(METHODS),
+        default="vote",
+        help="combination method (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="number of cores (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=256,
+        help="lines sent to each worker at a time (default: %(default)s)",
+    )
+    main(parser.parse_args())
@@ -7,7 +7,7 @@ import logging
 
 import numpy  # type: ignore
 
-from typing import Any, Iterator, List, Tuple
+from typing import Any, Dict, Iterator, List, Tuple
 
 
 Labels = List[Any]
@@ -55,3 +55,44 @@ def tsv_reader(path: str) -> Iterator[Tuple[Labels, Labels]]:
             # doesn't fail when `hypo` is null.
             hypo = hypo.rstrip()
             yield (gold.split(), hypo.split())
+
+
+def _counts(hypos: List[Labels]) -> Dict[Tuple[Any, ...], int]:
+    """Counts identical hypotheses, in order of first occurrence."""
+    counts: Dict[Tuple[Any, ...], int] = {}
+    for hypo in hypos:
+        key = tuple(hypo)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def vote(hypos: List[Labels]) -> Labels:
+    """Selects the most frequent hypothesis.
+
+    Ties are broken in favor of the earliest system."""
+    counts = _counts(hypos)
+    # Dictionaries preserve insertion order, so `max` returns the earliest
+    # of the tied hypotheses.
+    return list(max(counts, key=counts.__getitem__))
+
+
+def medoid(hypos: List[Labels]) -> Labels:
+    """Selects the hypothesis with the least total edit distance to the rest.
+
+    Ties are broken in favor of the more frequent hypothesis, and then in favor
+    of the earliest system."""
+    counts = _counts(hypos)
+    # Distances are only computed between unique hypotheses, weighted by how
+    # many systems produced each one.
+    uniques = list(counts)
+    costs = [0] * len(uniques)
+    for i in range(len(uniques)):
+        for j in range(i + 1, len(uniques)):
+            edits = edit_distance(uniques[i], uniques[j])
+            costs[i] += edits * counts[uniques[j]]
+            costs[j] += edits * counts[uniques[i]]
+    best = min(
+        range(len(uniques)),
+        key=lambda i: (costs[i], -counts[uniques[i]], i),
+    )
+    return list(uniques[best])
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+"""Columnar store for task 2 system predictions.
+
+The system predictions and gold data are three-column TSV files. For the
+predictions, the columns are the lemma, the predicted form, and the predicted
+paradigm slot; for the gold data, they are the lemma, the form, and the
+morphosyntactic tag. Reparsing them for every question is slow, so this module
+converts the whole tree into a dictionary-encoded columnar store: strings are
+interned in a single table and each column is stored as a NumPy array of IDs,
+which can be memory-mapped.
+
+Synopsis
+--------
+
+The store is a directory with the following contents:
+
+*   `manifest.json`: the list of systems and languages, and for each source
+    file, its modification time, size, and the range of rows it occupies.
+*   `strings.txt`: the string table, one string per line; the ID of a string
+    is its line number (counting from zero).
+*   `shards/`: the encoded rows of each source file, one array per file.
+*   `predictions/` and `gold/`: the concatenated columns.
+
+When the store is rebuilt, only files whose modification time or size has
+changed are reparsed. The string table is append-only, so IDs remain stable
+across rebuilds.
+
+Nota bene
+---------
+
+Predictions are matched against the gold data by lemma and form only, since
+the predicted paradigm slots are arbitrary cluster IDs. A prediction is said
+to be "attested" if the predicted form occurs somewhere in the gold paradigm
+of its lemma. Whether each prediction is attested, and whether each gold form
+is predicted by at least one system, is computed when the store is built, so
+that queries reduce to counting."""
+
+__author__ = "Kyle Gorman"
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+import numpy  # type: ignore
+
+
+VERSION = 1
+SPLITS = ["dev", "test"]
+PREDICTION_COLUMNS = [
+    "system",
+    "language",
+    "split",
+    "lemma",
+    "form",
+    "tag",
+    "attested",
+]
+GOLD_COLUMNS = ["language", "split", "lemma", "form", "tag", "predicted"]
+
+
+class Source(NamedTuple):
+
+    path: str
+    kind: str
+    system: str
+    language: str
+    split: str
+
+
+def _keys(columns: Dict[str, numpy.ndarray], size: int) -> numpy.ndarray:
+    """Packs language, lemma, and form IDs into a single integer key."""
+    key = columns["language"].astype(numpy.int64)
+    key = key * size + columns["lemma"]
+    return key * size + columns["form"]
+
+
+def _gold_sources(data_path: str) -> Iterator[Source]:
+    """Finds gold files, named like `<Lang>.V-<split>.gold`."""
+    for path in sorted(glob.glob(os.path.join(data_path, "*", "*.gold"))):
+        name = os.path.basename(path)
+        language = name.split(".", 1)[0]
+        split = name.rsplit(".V-", 1)[-1].split(".", 1)[0]
+        if split not in SPLITS:
+            logging.warning("Skipping gold file with unknown split: %s", path)
+            continue
+        yield Source(path, "gold", "", language, split)
+
+
+def _prediction_sources(
+    predictions_path: str, splits: Dict[str, str]
+) -> Iterator[Source]:
+    """Finds prediction files.
+
+    Systems do not agree on a naming scheme, so the language is taken to be
+    the part of the filename before the first period, and its split is
+    looked up in the gold data."""
+    for system in sorted(os.listdir(predictions_path)):
+        system_path = os.path.join(predictions_path, system)
+        if system.startswith(".") or not os.path.isdir(system_path):
+            continue
+        for (dirpath, dirnames, filenames) in os.walk(system_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.startswith("."):
+                    continue
+                path = os.path.join(dirpath, filename)
+                language = filename.split(".", 1)[0]
+                split = splits.get(language)
+                if split is None:
+                    logging.warning(
+                        "Skipping prediction file with unknown language: %s",
+                        path,
+                    )
+                    continue
+                yield Source(path, "prediction", system, language, split)
+
+
+class PredictionStore:
+    """Dictionary-encoded columnar store of predictions and gold data."""
+
+    def __init__(self, store_path: str) -> None:
+        self.store_path = store_path
+        with open(os.path.join(store_path, "manifest.json"), "r") as source:
+            manifest = json.load(source)
+        self.systems: List[str] = manifest["systems"]
+        self.languages: List[str] = manifest["languages"]
+        self.files: Dict[str, Dict] = manifest["files"]
+        self.strings = self._read_strings(store_path)
+        self.ids = {string: i for (i, string) in enumerate(self.strings)}
+        self.predictions = {
+            column: numpy.load(
+                os.path.join(store_path, "predictions", f"{column}.npy"),
+                mmap_mode="r",
+            )
+            for column in PREDICTION_COLUMNS
+        }
+        self.gold = {
+            column: numpy.load(
+                os.path.join(store_path, "gold", f"{column}.npy"),
+                mmap_mode="r",
+            )
+            for column in GOLD_COLUMNS
+        }
+
+    @staticmethod
+    def _read_strings(store_path: str) -> List[str]:
+        path = os.path.join(store_path, "strings.txt")
+        if not os.path.exists(path):
+            return []
+        # Strings may be empty, so we cannot simply iterate over lines.
+        with open(path, "r", encoding="utf8", newline="") as source:
+            contents = source.read()
+        return contents.split("\n") if contents else []
+
+    @staticmethod
+    def _read_manifest(store_path: str) -> Dict:
+        path = os.path.join(store_path, "manifest.json")
+        if not os.path.exists(path):
+            return {"version": VERSION, "files": {}}
+        with open(path, "r") as source:
+            manifest = json.load(source)
+        if manifest.get("version") != VERSION:
+            logging.info("Store version mismatch; rebuilding from scratch")
+            return {"version": VERSION, "files": {}}
+        return manifest
+
+    @staticmethod
+    def _save(path: str, array: numpy.ndarray) -> None:
+        """Saves an array, atomically replacing any existing file."""
+        tmp_path = f"{path}.tmp.npy"
+        numpy.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _encode(
+        path: str, strings: List[str], ids: Dict[str, int]
+    ) -> numpy.ndarray:
+        """Parses a TSV file into an array of string IDs."""
+        rows: List[Tuple[int, int, int]] = []
+        with open(path, "r", encoding="utf8") as source:
+            for (linenum, line) in enumerate(source, 1):
+                line = line.rstrip("\r\n")
+                if not line:
+                    continue
+                fields = line.split("\t")
+                if len(fields) != 3:
+                    raise ValueError(
+                        f"Expected 3 columns at {path}:{linenum}; "
+                        f"got {len(fields)}"
+                    )
+                row = []
+                for field in fields:
+                    i = ids.get(field)
+                    if i is None:
+                        i = len(strings)
+                        ids[field] = i
+                        strings.append(field)
+                    row.append(i)
+                rows.append(tuple(row))  # type: ignore
+        return numpy.array(rows, dtype=numpy.int32).reshape(-1, 3)
+
+    @classmethod
+    def build(
+        cls, store_path: str, predictions_path: str, data_path: str
+    ) -> "PredictionStore":
+        """Builds or incrementally updates the store."""
+        start = time.time()
+        shards_path = os.path.join(store_path, "shards")
+        os.makedirs(shards_path, exist_ok=True)
+        os.makedirs(os.path.join(store_path, "predictions"), exist_ok=True)
+        os.makedirs(os.path.join(store_path, "gold"), exist_ok=True)
+        old_files = cls._read_manifest(store_path)["files"]
+        strings = cls._read_strings(store_path)
+        ids = {string: i for (i, string) in enumerate(strings)}
+        num_strings = len(strings)
+        # Finds all the sources.
+        sources = list(_gold_sources(data_path))
+        splits = {source.language: source.split for source in sources}
+        sources.extend(_prediction_sources(predictions_path, splits))
+        # Sources are keyed by their path relative to the common root.
+        root = os.path.commonpath(
+            [os.path.abspath(data_path), os.path.abspath(predictions_path)]
+        )
+        # Encodes new and changed sources.
+        files: Dict[str, Dict] = {}
+        shards: Dict[str, numpy.ndarray] = {}
+        reparsed = 0
+        for source in sources:
+            key = os.path.relpath(os.path.abspath(source.path), root)
+            stat = os.stat(source.path)
+            shard = hashlib.md5(key.encode("utf8")).hexdigest() + ".npy"
+            shard_path = os.path.join(shards_path, shard)
+            entry = old_files.get(key)
+            if (
+                entry
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size
+                and os.path.exists(shard_path)
+            ):
+                shards[key] = numpy.load(shard_path)
+            else:
+                logging.debug("Encoding %s", source.path)
+                shards[key] = cls._encode(source.path, strings, ids)
+                cls._save(shard_path, shards[key])
+                reparsed += 1
+            files[key] = {
+                "kind": source.kind,
+                "system": source.system,
+                "language": source.language,
+                "split": source.split,
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "shard": shard,
+            }
+        logging.info(
+            "Encoded %d of %d files; %s new strings",
+            reparsed,
+            len(files),
+            f"{len(strings) - num_strings:,d}",
+        )
+        # Removes shards for sources which no longer exist.
+        live = {entry["shard"] for entry in files.values()}
+        for shard in os.listdir(shards_path):
+            if shard not in live:
+                os.remove(os.path.join(shards_path, shard))
+        if len(strings) > num_strings:
+            path = os.path.join(store_path, "strings.txt")
+            with open(f"{path}.tmp", "w", encoding="utf8", newline="") as sink:
+                sink.write("\n".join(strings))
+            os.replace(f"{path}.tmp", path)
+        # Concatenates the columns. Rows are ordered by system and language,
+        # so each file occupies a contiguous range of rows.
+        systems = sorted(
+            {s.system for s in sources if s.kind == "prediction"}
+        )
+        languages = sorted({s.language for s in sources})
+        system_index = {system: i for (i, system) in enumerate(systems)}
+        language_index = {lang: i for (i, lang) in enumerate(languages)}
+        tables: Dict[str, Dict[str, numpy.ndarray]] = {}
+        for (kind, dirname) in (
+            ("prediction", "predictions"),
+            ("gold", "gold"),
+        ):
+            keys = sorted(
+                (key for key in files if files[key]["kind"] == kind),
+                key=lambda key: (
+                    files[key]["system"],
+                    files[key]["language"],
+                    key,
+                ),
+            )
+            sizes = [len(shards[key]) for key in keys]
+            offset = 0
+            for (key, size) in zip(keys, sizes):
+                files[key]["start"] = offset
+                files[key]["stop"] = offset + size
+                offset += size
+            encoded = (
+                numpy.concatenate([shards[key] for key in keys])
+                if keys
+                else numpy.zeros((0, 3), dtype=numpy.int32)
+            )
+            tables[dirname] = {
+                "system": numpy.repeat(
+                    [
+                        system_index.get(files[key]["system"], -1)
+                        for key in keys
+                    ],
+                    sizes,
+                ).astype(numpy.int16),
+                "language": numpy.repeat(
+                    [language_index[files[key]["language"]] for key in keys],
+                    sizes,
+                ).astype(numpy.int16),
+                "split": numpy.repeat(
+                    [SPLITS.index(files[key]["split"]) for key in keys], sizes
+                ).astype(numpy.int8),
+                "lemma": encoded[:, 0],
+                "form": encoded[:, 1],
+                "tag": encoded[:, 2],
+            }
+        prediction_keys = _keys(tables["predictions"], len(strings))
+        gold_keys = _keys(tables["gold"], len(strings))
+        tables["predictions"]["attested"] = numpy.isin(
+            prediction_keys, gold_keys
+        )
+        tables["gold"]["predicted"] = numpy.isin(gold_keys, prediction_keys)
+        for (dirname, columns) in (
+            ("predictions", PREDICTION_COLUMNS),
+            ("gold", GOLD_COLUMNS),
+        ):
+            for column in columns:
+                cls._save(
+                    os.path.join(store_path, dirname, f"{column}.npy"),
+                    numpy.ascontiguousarray(tables[dirname][column]),
+                )
+        # The manifest is written last, so that an interrupted build is
+        # detected and redone next time.
+        manifest = {
+            "version": VERSION,
+            "systems": systems,
+            "languages": languages,
+            "files": files,
+        }
+        path = os.path.join(store_path, "manifest.json")
+        with open(f"{path}.tmp", "w") as sink:
+            json.dump(manifest, sink, indent=1, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+        logging.info("Built store in %.2fs", time.time() - start)
+        return cls(store_path)
+
+    # Queries.
+
+    def attested_rates(self) -> numpy.ndarray:
+        """Computes the rate of attested predictions.
+
+        Returns:
+            A (systems x languages) array; NaN marks pairs with no predictions.
+        """
+        size = len(self.systems) * len(self.languages)
+        cells = (
+            self.predictions["system"].astype(numpy.int64)
+            * len(self.languages)
+            + self.predictions["language"]
+        )
+        total = numpy.bincount(cells, minlength=size)
+        good = numpy.bincount(
+            cells, weights=self.predictions["attested"], minlength=size
+        )
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            rates = good / total
+        return rates.reshape(len(self.systems), len(self.languages))
+
+    def oracle_recall(self) -> numpy.ndarray:
+        """Computes the rate of gold forms predicted by at least one system.
+
+        Returns:
+            An array indexed by language; NaN marks languages with no gold
+            data.
+        """
+        size = len(self.languages)
+        total = numpy.bincount(self.gold["language"], minlength=size)
+        good = numpy.bincount(
+            self.gold["language"],
+            weights=self.gold["predicted"],
+            minlength=size,
+        )
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return good / total
+
+    def lemma_results(self, language: str, lemma: str) -> Dict[str, int]:
+        """Counts the attested predictions of each system for a lemma.
+
+        Systems which made no predictions for the lemma are omitted."""
+        lemma_id = self.ids.get(lemma)
+        if lemma_id is None or language not in self.languages:
+            return {}
+        mask = (
+            self.predictions["language"] == self.languages.index(language)
+        ) & (self.predictions["lemma"] == lemma_id)
+        system = self.predictions["system"][mask]
+        total = numpy.bincount(system, minlength=len(self.systems))
+        good = numpy.bincount(
+            system,
+            weights=self.predictions["attested"][mask],
+            minlength=len(self.systems),
+        )
+        return {
+            self.systems[i]: int(good[i])
+            for i in numpy.flatnonzero(total)
+        }
+
+    def rows(self, system: str, language: str) -> slice:
+        """Returns the range of prediction rows for a system and language."""
+        for entry in self.files.values():
+            if (
+                entry["kind"] == "prediction"
+                and entry["system"] == system
+                and entry["language"] == language
+            ):
+                return slice(entry["start"], entry["stop"])
+        raise KeyError((system, language))
+
+
+def _percentages(rates: numpy.ndarray) -> List[str]:
+    return ["" if numpy.isnan(rate) else f"{100 * rate:.2f}" for rate in rates]
+
+
+def main(args: argparse.Namespace) -> None:
+    store = PredictionStore.build(
+        args.store_path, args.predictions_path, args.data_path
+    )
+    start = time.time()
+    rates = store.attested_rates()
+    oracle = store.oracle_recall()
+    logging.info("Queried store in %.3fs", time.time() - start)
+    print("\t".join(["system", *store.languages]))
+    for (system, row) in zip(store.systems, rates):
+        print("\t".join([system, *_percentages(row)]))
+    print("\t".join(["oracle recall", *_percentages(oracle)]))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level="INFO", format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(
+        description="Builds columnar store for task 2 system predictions"
+    )
+    parser.add_argument(
+        "--store_path", required=True, help="path to store directory"
+    )
+    parser.add_argument(
+        "--predictions_path",
+        default="../system_predictions",
+        help="path to system predictions (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--data_path",
+        default="../data",
+        help="path to gold data (default: %(default)s)",
+    )
+    main(parser.parse_args())